@@ -6,7 +6,7 @@ import hashlib
 import os.path
 import re
 import sys
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import pkg_resources
 
@@ -15,9 +15,9 @@ from sacred import SETTINGS
 from sacred.utils import iter_prefixes
 
 MB = 1048576
-MODULE_BLACKLIST = set(sys.builtin_module_names)
-# sadly many builtins are missing from the above, so we list them manually:
-MODULE_BLACKLIST |= {
+# sadly many builtins are missing from sys.builtin_module_names,
+# so we list them manually:
+MODULE_BLACKLIST = frozenset(sys.builtin_module_names) | {
     None,
     "__future__",
     "_abcoll",
@@ -361,17 +361,10 @@ MODULE_BLACKLIST |= {
 }
 
 module = type(sys)
+# use with fullmatch. The groups are:
+# epoch, release, pre-release, post-release, development release
 PEP440_VERSION_PATTERN = re.compile(
-    r"""
-^
-(\d+!)?              # epoch
-(\d[.\d]*(?<= \d))   # release
-((?:[abc]|rc)\d+)?   # pre-release
-(?:(\.post\d+))?     # post-release
-(?:(\.dev\d+))?      # development release
-$
-""",
-    flags=re.VERBOSE,
+    r"(\d+!)?(\d[.\d]*(?<=\d))((?:[abc]|rc)\d+)?(?:(\.post\d+))?(?:(\.dev\d+))?"
 )
 
 
@@ -386,18 +379,99 @@ def get_py_file_if_possible(pyc_name):
     return pyc_name
 
 
-def get_digest(filename):
-    """Compute the MD5 hash for a given file."""
-    h = hashlib.md5()
-    with open(filename, "rb") as f:
-        data = f.read(1 * MB)
-        while data:
-            h.update(data)
-            data = f.read(1 * MB)
-        return h.hexdigest()
+# (stat results, digest) by filename and algorithm, so unchanged files are
+# not rehashed. Only the latest version of each file is kept.
+_DIGEST_CACHE = {}
+# dependencies from the pkg_resources working set and the state it was built for
+_PKG_DEPENDENCIES = None
 
 
-def get_commit_if_possible(filename):
+# supported digest algorithms:
+# (prefix of the digest, name of the hashlib constructor, its arguments)
+DIGEST_ALGORITHMS = {
+    "md5": ("", "md5", {}),
+    # hashlib.blake2b requires Python >= 3.6
+    "blake2b-128": ("b2:", "blake2b", {"digest_size": 16}),
+}
+
+
+def get_digest(filename, algorithm="md5"):
+    """Compute the hash for a given file (by default MD5).
+
+    Digests of algorithms other than MD5 are prefixed with a tag
+    (e.g. 'b2:' for blake2b-128), to tell the formats apart.
+    """
+    try:
+        prefix, name, kwargs = DIGEST_ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError('Unknown digest algorithm "{}"'.format(algorithm))
+    if not hasattr(hashlib, name):
+        raise ValueError(
+            'Digest algorithm "{}" is not available in this Python version'.format(
+                algorithm
+            )
+        )
+    constructor = functools.partial(getattr(hashlib, name), **kwargs)
+    with open(filename, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if hasattr(hashlib, "file_digest"):  # Python >= 3.11
+            return prefix + hashlib.file_digest(f, constructor).hexdigest()
+        h = constructor()
+        buf = bytearray(1 * MB)
+        view = memoryview(buf)
+        while True:
+            size = f.readinto(buf)
+            if not size:
+                break
+            h.update(view[:size])
+        return prefix + h.hexdigest()
+
+
+def get_md5_digest(filename, digest):
+    """Return digest if it is an MD5 sum, otherwise the MD5 sum of the file.
+
+    Source digests might be git blob hashes or use another algorithm
+    (see SETTINGS.GIT_SOURCE_DIGESTS and SETTINGS.SOURCE_DIGEST_ALGO),
+    but some observers identify stored sources by their MD5 sum.
+    """
+    if len(digest) == 32 and ":" not in digest:
+        return digest
+    return get_digest(filename)
+
+
+def get_cached_digest(filename):
+    """Compute the digest of a source file with SETTINGS.SOURCE_DIGEST_ALGO.
+
+    The result is reused as long as the file is unchanged.
+    """
+    algorithm = SETTINGS["SOURCE_DIGEST_ALGO"]
+    stat = os.stat(filename)
+    # ctime changes on every write, even if the mtime is reset afterwards
+    stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+    cached_stat_key, digest = _DIGEST_CACHE.get((filename, algorithm), (None, None))
+    if cached_stat_key != stat_key:
+        digest = get_digest(filename, algorithm)
+        _DIGEST_CACHE[filename, algorithm] = stat_key, digest
+    return digest
+
+
+class VCSCache:
+    """Reuses VCS lookups, e.g. for the duration of one gathering of sources.
+
+    It is passed explicitly to the functions that look up VCS information,
+    so concurrent gatherings never share or reset each other's state.
+    """
+
+    def __init__(self):
+        # (path, commit, is_dirty) per directory and per git working directory
+        self.directories = {}
+        self.repos = {}
+        # git index entries of tracked files in clean repositories by working dir
+        self.blobs = {}
+
+
+def get_commit_if_possible(filename, vcs_cache=None):
     """Try to retrieve VCS information for a given file.
 
     Currently only supports git using the gitpython package.
@@ -405,6 +479,9 @@ def get_commit_if_possible(filename):
     Parameters
     ----------
     filename : str
+    vcs_cache : VCSCache, optional
+        Reuse and store the results of previous lookups.
+        Without it, the repository is inspected again on every call.
 
     Returns
     -------
@@ -415,42 +492,114 @@ def get_commit_if_possible(filename):
         is_dirty: bool
             True if there are uncommitted changes in the repository
     """
+    directory = os.path.dirname(filename)
+    if vcs_cache is None:
+        return _get_commit_from_directory(directory, vcs_cache)
+    if directory not in vcs_cache.directories:
+        vcs_cache.directories[directory] = _get_commit_from_directory(
+            directory, vcs_cache
+        )
+    return vcs_cache.directories[directory]
+
+
+def _get_commit_from_directory(directory, vcs_cache):
     # git
     if opt.has_gitpython:
         from git import Repo, InvalidGitRepositoryError
 
         try:
-            directory = os.path.dirname(filename)
             repo = Repo(directory, search_parent_directories=True)
-            try:
-                path = repo.remote().url
-            except ValueError:
-                path = "git:/" + repo.working_dir
-            is_dirty = repo.is_dirty()
-            commit = repo.head.commit.hexsha
-            return path, commit, is_dirty
+            if vcs_cache is None:
+                return _get_commit_from_repo(repo, vcs_cache)
+            if repo.working_dir not in vcs_cache.repos:
+                vcs_cache.repos[repo.working_dir] = _get_commit_from_repo(
+                    repo, vcs_cache
+                )
+            return vcs_cache.repos[repo.working_dir]
         except (InvalidGitRepositoryError, ValueError):
             pass
     return None, None, None
 
 
-@functools.total_ordering
+def _get_commit_from_repo(repo, vcs_cache):
+    try:
+        path = repo.remote().url
+    except ValueError:
+        path = "git:/" + repo.working_dir
+    is_dirty = repo.is_dirty()
+    commit = repo.head.commit.hexsha
+    if SETTINGS["GIT_SOURCE_DIGESTS"] and not is_dirty and vcs_cache is not None:
+        vcs_cache.blobs[repo.working_dir] = {
+            os.path.join(repo.working_dir, os.path.normpath(p)): e
+            for (p, _), e in repo.index.entries.items()
+        }
+    return path, commit, is_dirty
+
+
+def get_git_blob_digest(filename, vcs_cache=None):
+    """Return the git blob hash of a file from a clean repository, or None.
+
+    The digest is prefixed with 'git:'. It is only available if size and
+    modification time of the file still match the git index.
+    With a vcs_cache, the index entries are taken from it, so
+    SETTINGS.GIT_SOURCE_DIGESTS has to be enabled and get_commit_if_possible
+    has to be called for that file before with the same vcs_cache.
+    Without one, only the entry of this file is looked up in the index.
+    """
+    if vcs_cache is None:
+        entry = _get_git_index_entry(filename)
+    else:
+        entry = None
+        for blobs in vcs_cache.blobs.values():
+            entry = blobs.get(filename, entry)
+    if entry is None:
+        return None
+    stat = os.stat(filename)
+    mtime = divmod(stat.st_mtime_ns, 1000000000)
+    if stat.st_size == entry.size and mtime == tuple(entry.mtime):
+        return "git:" + entry.hexsha
+    return None
+
+
+def _get_git_index_entry(filename):
+    if opt.has_gitpython:
+        from git import Repo, InvalidGitRepositoryError
+
+        try:
+            repo = Repo(os.path.dirname(filename), search_parent_directories=True)
+        except InvalidGitRepositoryError:
+            return None
+        path = os.path.relpath(filename, repo.working_dir).replace(os.sep, "/")
+        return repo.index.entries.get((path, 0))
+    return None
+
+
 class Source:
     def __init__(self, filename, digest, repo, commit, isdirty):
         self.filename = filename
-        self.digest = digest
+        self._digest = digest
         self.repo = repo
         self.commit = commit
         self.is_dirty = isdirty
 
+    @property
+    def digest(self):
+        """The digest of the file, computed on first access if not given."""
+        if self._digest is None:
+            self._digest = get_cached_digest(self.filename)
+        return self._digest
+
     @staticmethod
-    def create(filename):
+    def create(filename, vcs_cache=None):
         if not filename or not os.path.exists(filename):
             raise ValueError('invalid filename or file not found "{}"'.format(filename))
 
         main_file = get_py_file_if_possible(os.path.abspath(filename))
-        repo, commit, is_dirty = get_commit_if_possible(main_file)
-        return Source(main_file, get_digest(main_file), repo, commit, is_dirty)
+        repo, commit, is_dirty = get_commit_if_possible(main_file, vcs_cache)
+        digest = None
+        if SETTINGS["GIT_SOURCE_DIGESTS"] and commit is not None and not is_dirty:
+            digest = get_git_blob_digest(main_file, vcs_cache)
+        return Source(main_file, digest, repo, commit, is_dirty)
 
     def to_json(self, base_dir=None):
         if base_dir:
@@ -469,14 +618,13 @@ class Source:
         else:
             return False
 
-    def __le__(self, other):
-        return self.filename.__le__(other.filename)
+    def __lt__(self, other):
+        return self.filename < other.filename
 
     def __repr__(self):
         return "<Source: {}>".format(self.filename)
 
 
-@functools.total_ordering
 class PackageDependency:
     modname_to_dist = {}
 
@@ -502,8 +650,8 @@ class PackageDependency:
         else:
             return False
 
-    def __le__(self, other):
-        return self.name.__le__(other.name)
+    def __lt__(self, other):
+        return self.name < other.name
 
     def __repr__(self):
         return "<PackageDependency: {}={}>".format(self.name, self.version)
@@ -526,16 +674,38 @@ class PackageDependency:
         return PackageDependency(name, version)
 
 
+def splitall(path):
+    """Split a path into a tuple of all its components."""
+    path = os.path.normpath(path)
+    if os.altsep:
+        path = path.replace(os.altsep, os.sep)
+    parts = path.split(os.sep)
+    if path.startswith(os.sep):
+        # keep the root instead of the empty string before the leading sep
+        parts[0] = os.sep
+    return tuple(parts)
+
+
+@functools.lru_cache(maxsize=4096)
 def convert_path_to_module_parts(path):
-    """Convert path to a python file into list of module names."""
-    module_parts = list(path.parts)
-    if module_parts[-1] in ["__init__.py", "__init__.pyc"]:
+    """Convert path to a python file into a tuple of (interned) module names."""
+    module_parts = splitall(path)
+    if module_parts[-1] in ("__init__.py", "__init__.pyc"):
         # remove trailing __init__.py
         module_parts = module_parts[:-1]
     else:
         # remove file extension
-        module_parts[-1], _ = os.path.splitext(module_parts[-1])
-    return module_parts
+        module_parts = module_parts[:-1] + (os.path.splitext(module_parts[-1])[0],)
+    return tuple(sys.intern(p) for p in module_parts)
+
+
+@functools.lru_cache(maxsize=32)
+def get_base_path_prefix(experiment_path):
+    """Return the resolved (absolute) experiment path ending with a separator.
+
+    The case is normalized, so compare it with os.path.normcase'd paths.
+    """
+    return os.path.normcase(os.path.join(os.path.realpath(experiment_path), ""))
 
 
 def is_local_source(filename, modname, experiment_path):
@@ -562,36 +732,42 @@ def is_local_source(filename, modname, experiment_path):
         True if the module was imported locally from (a subdir of) the
         experiment_path, and False otherwise.
     """
-    filename = Path(os.path.abspath(os.path.realpath(filename)))
-    experiment_path = Path(os.path.abspath(os.path.realpath(experiment_path)))
-    if experiment_path not in filename.parents:
+    filename = os.path.realpath(filename)
+    base = get_base_path_prefix(os.path.abspath(experiment_path))
+    # normcase keeps the length, so the relative part can be sliced off below
+    if not os.path.normcase(filename).startswith(base):
         return False
-    rel_path = filename.relative_to(experiment_path)
-    path_parts = convert_path_to_module_parts(rel_path)
+    path_parts = convert_path_to_module_parts(filename[len(base) :])
 
-    mod_parts = modname.split(".")
+    mod_parts = tuple(sys.intern(m) for m in modname.split("."))
     if path_parts == mod_parts:
         return True
     if len(path_parts) > len(mod_parts):
         return False
     abs_path_parts = convert_path_to_module_parts(filename)
-    return all([p == m for p, m in zip(reversed(abs_path_parts), reversed(mod_parts))])
+    # all parts are interned, so comparing the identity is sufficient
+    return all(p is m for p, m in zip(reversed(abs_path_parts), reversed(mod_parts)))
 
 
-def get_main_file(globs):
+def get_absolute_path(filename):
+    """Like os.path.abspath, but return absolute paths (e.g. __file__) as is."""
+    return filename if os.path.isabs(filename) else os.path.abspath(filename)
+
+
+def get_main_file(globs, vcs_cache=None):
     filename = globs.get("__file__")
 
     if filename is None:
         experiment_path = os.path.abspath(os.path.curdir)
         main = None
     else:
-        main = Source.create(globs.get("__file__"))
+        main = Source.create(globs.get("__file__"), vcs_cache)
         experiment_path = os.path.dirname(main.filename)
     return experiment_path, main
 
 
 def iterate_imported_modules(globs):
-    checked_modules = set(MODULE_BLACKLIST)
+    checked_modules = set()
     for glob in globs.values():
         if isinstance(glob, module):
             mod_path = glob.__name__
@@ -600,11 +776,12 @@ def iterate_imported_modules(globs):
         else:
             continue  # pragma: no cover
 
-        if not mod_path:
+        if not mod_path or mod_path in checked_modules:
+            # all prefixes of a checked module have been checked as well
             continue
 
         for modname in iter_prefixes(mod_path):
-            if modname in checked_modules:
+            if modname in MODULE_BLACKLIST or modname in checked_modules:
                 continue
             checked_modules.add(modname)
             mod = sys.modules.get(modname)
@@ -614,12 +791,19 @@ def iterate_imported_modules(globs):
 
 def iterate_all_python_files(base_path):
     # TODO support ignored directories/files
-    for dirname, subdirlist, filelist in os.walk(base_path):
-        if "__pycache__" in dirname:
-            continue
-        for filename in filelist:
-            if filename.endswith(".py"):
-                yield os.path.join(base_path, dirname, filename)
+    directories = [base_path]
+    while directories:
+        try:
+            entries = list(os.scandir(directories.pop()))
+        except OSError:
+            continue  # like os.walk, skip directories that cannot be listed
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                # skip caches and hidden directories like .git or .venv
+                if entry.name != "__pycache__" and not entry.name.startswith("."):
+                    directories.append(entry.path)
+            elif entry.name.endswith(".py"):
+                yield entry.path
 
 
 def iterate_sys_modules():
@@ -629,50 +813,90 @@ def iterate_sys_modules():
             yield modname, mod
 
 
-def get_sources_from_modules(module_iterator, base_path):
+def get_sources_from_modules(module_iterator, base_path, vcs_cache=None):
     sources = set()
     for modname, mod in module_iterator:
         # hasattr doesn't work with python extensions
         if not getattr(mod, "__file__", None):
             continue
 
-        filename = os.path.abspath(mod.__file__)
+        filename = get_absolute_path(mod.__file__)
         if filename not in sources and is_local_source(filename, modname, base_path):
-            s = Source.create(filename)
+            s = Source.create(filename, vcs_cache)
             sources.add(s)
     return sources
 
 
+def add_package_dependency(dependencies, modname, mod):
+    """Add a non-local module to dependencies if it is a versioned package."""
+    if modname.startswith("_") or "." in modname:
+        return
+
+    try:
+        pdep = PackageDependency.create(mod)
+        if pdep.version is not None:
+            dependencies.add(pdep)
+    except AttributeError:
+        pass
+
+
 def get_dependencies_from_modules(module_iterator, base_path):
     dependencies = set()
     for modname, mod in module_iterator:
         # hasattr doesn't work with python extensions
         if getattr(mod, "__file__", None) and is_local_source(
-            os.path.abspath(mod.__file__), modname, base_path
+            get_absolute_path(mod.__file__), modname, base_path
         ):
             continue
-        if modname.startswith("_") or "." in modname:
-            continue
-
-        try:
-            pdep = PackageDependency.create(mod)
-            if pdep.version is not None:
-                dependencies.add(pdep)
-        except AttributeError:
-            pass
+        add_package_dependency(dependencies, modname, mod)
     return dependencies
 
 
-def get_sources_from_sys_modules(globs, base_path):
-    return get_sources_from_modules(iterate_sys_modules(), base_path)
+def get_sources_and_dependencies_from_modules(
+    module_iterator, base_path, vcs_cache=None
+):
+    """Classify modules into local sources and package dependencies at once."""
+    sources = set()
+    dependencies = set()
+    for modname, mod in module_iterator:
+        # hasattr doesn't work with python extensions
+        filename = getattr(mod, "__file__", None)
+        if filename:
+            filename = get_absolute_path(filename)
+            if is_local_source(filename, modname, base_path):
+                if filename not in sources:
+                    sources.add(Source.create(filename, vcs_cache))
+                continue
+        add_package_dependency(dependencies, modname, mod)
+    return sources, dependencies
+
+
+def get_sources_from_sys_modules(globs, base_path, vcs_cache=None):
+    return get_sources_from_modules(iterate_sys_modules(), base_path, vcs_cache)
+
 
+def get_sources_from_imported_modules(globs, base_path, vcs_cache=None):
+    return get_sources_from_modules(
+        iterate_imported_modules(globs), base_path, vcs_cache
+    )
 
-def get_sources_from_imported_modules(globs, base_path):
-    return get_sources_from_modules(iterate_imported_modules(globs), base_path)
 
+def get_sources_from_local_dir(globs, base_path, vcs_cache=None):
+    vcs_cache = vcs_cache or VCSCache()
 
-def get_sources_from_local_dir(globs, base_path):
-    return {Source.create(filename) for filename in iterate_all_python_files(base_path)}
+    def create_hashed_source(filename):
+        source = Source.create(filename, vcs_cache)
+        source.digest  # compute the digest in the worker thread
+        return source
+
+    filenames = [os.path.abspath(f) for f in iterate_all_python_files(base_path)]
+    # look up the VCS information of each directory once, before the
+    # worker threads only read it from the cache
+    for filename in {os.path.dirname(f): f for f in filenames}.values():
+        get_commit_if_possible(filename, vcs_cache)
+    # hashing releases the GIL, so threads can overlap reading and hashing
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        return set(executor.map(create_hashed_source, filenames))
 
 
 def get_dependencies_from_sys_modules(globs, base_path):
@@ -684,16 +908,22 @@ def get_dependencies_from_imported_modules(globs, base_path):
 
 
 def get_dependencies_from_pkg(globs, base_path):
-    dependencies = set()
-    for dist in pkg_resources.working_set:
-        if dist.version == "0.0.0":
-            continue  # ugly hack to deal with pkg-resource version bug
-        dependencies.add(PackageDependency(dist.project_name, dist.version))
-    return dependencies
+    global _PKG_DEPENDENCIES
+    working_set = pkg_resources.working_set
+    key = (id(working_set), len(working_set.entries), len(working_set.by_key))
+    if _PKG_DEPENDENCIES is None or _PKG_DEPENDENCIES[0] != key:
+        dependencies = set()
+        for dist in working_set:
+            if dist.version == "0.0.0":
+                continue  # ugly hack to deal with pkg-resource version bug
+            dependencies.add(PackageDependency(dist.project_name, dist.version))
+        _PKG_DEPENDENCIES = key, dependencies
+    # return a copy because the caller might add further dependencies
+    return set(_PKG_DEPENDENCIES[1])
 
 
 source_discovery_strategies = {
-    "none": lambda globs, path: set(),
+    "none": lambda globs, path, vcs_cache=None: set(),
     "imported": get_sources_from_imported_modules,
     "sys": get_sources_from_sys_modules,
     "dir": get_sources_from_local_dir,
@@ -707,23 +937,40 @@ dependency_discovery_strategies = {
 }
 
 
+# strategies for which sources and dependencies can be found in a single pass
+shared_module_iterators = {
+    "imported": iterate_imported_modules,
+    "sys": lambda globs: iterate_sys_modules(),
+}
+
+
 def gather_sources_and_dependencies(globs, base_dir=None):
     """Scan the given globals for modules and return them as dependencies."""
-
-    experiment_path, main = get_main_file(globs)
+    # look up the state of each repository only once per gathering
+    vcs_cache = VCSCache()
+    experiment_path, main = get_main_file(globs, vcs_cache)
 
     base_dir = base_dir or experiment_path
 
-    gather_sources = source_discovery_strategies[SETTINGS["DISCOVER_SOURCES"]]
-    sources = gather_sources(globs, base_dir)
+    source_strategy = SETTINGS["DISCOVER_SOURCES"]
+    dependency_strategy = SETTINGS["DISCOVER_DEPENDENCIES"]
+    if (
+        source_strategy == dependency_strategy
+        and source_strategy in shared_module_iterators
+    ):
+        module_iterator = shared_module_iterators[source_strategy](globs)
+        sources, dependencies = get_sources_and_dependencies_from_modules(
+            module_iterator, base_dir, vcs_cache
+        )
+    else:
+        gather_sources = source_discovery_strategies[source_strategy]
+        sources = gather_sources(globs, base_dir, vcs_cache)
+        gather_dependencies = dependency_discovery_strategies[dependency_strategy]
+        dependencies = gather_dependencies(globs, base_dir)
+
     if main is not None:
         sources.add(main)
 
-    gather_dependencies = dependency_discovery_strategies[
-        SETTINGS["DISCOVER_DEPENDENCIES"]
-    ]
-    dependencies = gather_dependencies(globs, base_dir)
-
     if opt.has_numpy:
         # Add numpy as a dependency because it might be used for randomness
         dependencies.add(PackageDependency.create(opt.np))
@@ -287,7 +287,7 @@ class Ingredient:
         :param version: The (minimum) version of the package
         :type version: str
         """
-        if not PEP440_VERSION_PATTERN.match(version):
+        if not PEP440_VERSION_PATTERN.fullmatch(version):
             raise ValueError('Invalid Version: "{}"'.format(version))
         self.dependencies.add(PackageDependency(package_name, version))
 
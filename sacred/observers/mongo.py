@@ -12,7 +12,7 @@ import warnings
 
 import sacred.optional as opt
 from sacred.commandline_options import CommandLineOption
-from sacred.dependencies import get_digest
+from sacred.dependencies import get_digest, get_md5_digest
 from sacred.observers.base import RunObserver
 from sacred.observers.queue import QueueObserver
 from sacred.serializer import flatten
@@ -397,6 +397,7 @@ class MongoObserver(RunObserver):
         source_info = []
         for source_name, md5 in ex_info["sources"]:
             abs_path = os.path.join(base_dir, source_name)
+            md5 = get_md5_digest(abs_path, md5)
             file = self.fs.find_one({"filename": abs_path, "md5": md5})
             if file:
                 _id = file._id
@@ -5,7 +5,7 @@ import os
 import sqlalchemy as sa
 from sqlalchemy.ext.declarative import declarative_base
 
-from sacred.dependencies import get_digest
+from sacred.dependencies import get_digest, get_md5_digest
 from sacred.serializer import restore
 
 
@@ -17,12 +17,13 @@ class Source(Base):
 
     @classmethod
     def get_or_create(cls, filename, md5sum, session, basedir):
+        full_path = os.path.join(basedir, filename)
+        md5sum = get_md5_digest(full_path, md5sum)
         instance = (
             session.query(cls).filter_by(filename=filename, md5sum=md5sum).first()
         )
         if instance:
             return instance
-        full_path = os.path.join(basedir, filename)
         md5sum_ = get_digest(full_path)
         assert md5sum_ == md5sum, "found md5 mismatch for {}: {} != {}".format(
             filename, md5sum, md5sum_
@@ -11,6 +11,7 @@ import warnings
 
 from sacred.__about__ import __version__
 from sacred.commandline_options import CommandLineOption
+from sacred.dependencies import get_md5_digest
 from sacred.observers import RunObserver
 
 
@@ -75,7 +76,7 @@ class TinyDbObserver(RunObserver):
             abs_path = os.path.expandvars(abs_path)
             handle = BufferedReaderWrapper(open(abs_path, "rb"))
 
-            file = self.fs.get(md5)
+            file = self.fs.get(get_md5_digest(abs_path, md5))
             if file:
                 id_ = file.id
             else:
@@ -47,5 +47,15 @@ SETTINGS = munchify(
         "DISCOVER_DEPENDENCIES": "imported",
         # configure how source-files are discovered. [none, imported, sys, dir]
         "DISCOVER_SOURCES": "imported",
+        # use the git blob hash (prefixed with 'git:') as digest for unchanged
+        # sources tracked by a clean git repository. This avoids reading those
+        # files and takes precedence over SOURCE_DIGEST_ALGO, but observers
+        # that store sources by their MD5 sum then have to hash them again.
+        "GIT_SOURCE_DIGESTS": False,
+        # hash algorithm for the digests of all other sources.
+        # ['md5', 'blake2b-128'] blake2b-128 is faster, but observers that
+        # store sources by their MD5 sum (SQL, MongoDB, TinyDB) then have to
+        # hash those files again.
+        "SOURCE_DIGEST_ALGO": "md5",
     }
 )
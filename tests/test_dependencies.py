@@ -3,6 +3,8 @@
 
 import os.path
 import os
+import subprocess
+import sys
 
 import mock
 import pytest
@@ -10,12 +12,25 @@ from sacred.dependencies import (
     PEP440_VERSION_PATTERN,
     PackageDependency,
     Source,
+    VCSCache,
     gather_sources_and_dependencies,
+    get_dependencies_from_modules,
+    get_dependencies_from_pkg,
+    get_sources_from_local_dir,
+    get_sources_and_dependencies_from_modules,
+    get_sources_from_modules,
+    get_cached_digest,
+    get_commit_if_possible,
     get_digest,
+    get_md5_digest,
     get_py_file_if_possible,
     is_local_source,
+    iterate_all_python_files,
+    iterate_imported_modules,
+    splitall,
 )
 import sacred.optional as opt
+from sacred import SETTINGS
 
 TEST_DIRECTORY = os.path.dirname(__file__)
 EXAMPLE_SOURCE = os.path.join(TEST_DIRECTORY, "__init__.py")
@@ -54,13 +69,14 @@ EXAMPLE_DIGEST = "9e428c0aa58b75ff150c4f625e32af68"
     ],
 )
 def test_pep440_version_pattern(version):
-    assert PEP440_VERSION_PATTERN.match(version)
+    assert PEP440_VERSION_PATTERN.fullmatch(version)
 
 
 def test_pep440_version_pattern_invalid():
-    assert PEP440_VERSION_PATTERN.match("foo") is None
-    assert PEP440_VERSION_PATTERN.match("_12_") is None
-    assert PEP440_VERSION_PATTERN.match("version 4") is None
+    assert PEP440_VERSION_PATTERN.fullmatch("foo") is None
+    assert PEP440_VERSION_PATTERN.fullmatch("_12_") is None
+    assert PEP440_VERSION_PATTERN.fullmatch("version 4") is None
+    assert PEP440_VERSION_PATTERN.fullmatch("1.0 beta") is None
 
 
 @pytest.mark.skipif(os.name == "nt", reason="Weird win bug")
@@ -68,6 +84,80 @@ def test_source_get_digest():
     assert get_digest(EXAMPLE_SOURCE) == EXAMPLE_DIGEST
 
 
+def test_get_cached_digest_detects_changes(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write("a = 1\n")
+    digest = get_cached_digest(str(f))
+    assert digest == get_digest(str(f))
+    f.write("a = 12\n")
+    assert get_cached_digest(str(f)) == get_digest(str(f)) != digest
+
+
+def test_get_cached_digest_keeps_one_entry_per_file(tmpdir):
+    from sacred import dependencies
+
+    f = tmpdir.join("example.py")
+    for i in range(3):
+        f.write("a = {}\n".format(i * 10))
+        assert get_cached_digest(str(f)) == get_digest(str(f))
+    assert [k for k in dependencies._DIGEST_CACHE if k[0] == str(f)] == [
+        (str(f), "md5")
+    ]
+
+
+def test_get_cached_digest_detects_same_size_changes(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write("lr = 0.1\n")
+    stat = os.stat(str(f))
+    digest = get_cached_digest(str(f))
+    f.write("lr = 0.2\n")
+    os.utime(str(f), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert get_cached_digest(str(f)) == get_digest(str(f)) != digest
+
+
+def test_get_digest_blake2b():
+    digest = get_digest(EXAMPLE_SOURCE, "blake2b-128")
+    assert digest.startswith("b2:")
+    assert len(digest) == len("b2:") + 32
+    assert digest != "b2:" + get_digest(EXAMPLE_SOURCE)
+
+
+def test_get_digest_does_not_require_blake2b(monkeypatch):
+    import hashlib
+
+    monkeypatch.delattr(hashlib, "blake2b")
+    assert get_digest(EXAMPLE_SOURCE) == EXAMPLE_DIGEST
+    with pytest.raises(ValueError):
+        get_digest(EXAMPLE_SOURCE, "blake2b-128")
+
+
+def test_import_does_not_require_blake2b():
+    code = "import hashlib; del hashlib.blake2b; import sacred.dependencies"
+    subprocess.check_call([sys.executable, "-c", code], cwd=os.path.dirname(TEST_DIRECTORY))
+
+
+@pytest.mark.parametrize(
+    "digest, is_md5", [(EXAMPLE_DIGEST, True), ("b2:" + EXAMPLE_DIGEST, False)]
+)
+def test_get_md5_digest(digest, is_md5):
+    assert get_md5_digest(EXAMPLE_SOURCE, digest) == EXAMPLE_DIGEST
+    with mock.patch("sacred.dependencies.get_digest") as get_digest_mock:
+        get_digest_mock.return_value = EXAMPLE_DIGEST
+        get_md5_digest(EXAMPLE_SOURCE, digest)
+        assert get_digest_mock.called != is_md5
+
+
+def test_get_digest_unknown_algorithm():
+    with pytest.raises(ValueError):
+        get_digest(EXAMPLE_SOURCE, "sha1000")
+
+
+def test_source_digest_algorithm_setting(monkeypatch):
+    monkeypatch.setitem(SETTINGS, "SOURCE_DIGEST_ALGO", "blake2b-128")
+    s = Source.create(EXAMPLE_SOURCE)
+    assert s.digest == get_digest(s.filename, "blake2b-128")
+
+
 def test_source_create_empty():
     with pytest.raises(ValueError):
         Source.create("")
@@ -85,12 +175,132 @@ def test_source_create_py():
     assert s.digest == EXAMPLE_DIGEST
 
 
+@pytest.mark.skipif(os.name == "nt", reason="Weird win bug")
+def test_source_digest_is_computed_lazily():
+    with mock.patch("sacred.dependencies.get_cached_digest") as get_cached_digest:
+        get_cached_digest.return_value = EXAMPLE_DIGEST
+        s = Source.create(EXAMPLE_SOURCE)
+        assert not get_cached_digest.called
+        assert s.digest == EXAMPLE_DIGEST
+        assert s.digest == EXAMPLE_DIGEST
+        get_cached_digest.assert_called_once_with(os.path.abspath(EXAMPLE_SOURCE))
+
+
 @pytest.mark.skipif(os.name == "nt", reason="Weird win bug")
 def test_source_to_json():
     s = Source.create(EXAMPLE_SOURCE)
     assert s.to_json() == (os.path.abspath(EXAMPLE_SOURCE), EXAMPLE_DIGEST)
 
 
+@pytest.mark.skipif(not opt.has_gitpython, reason="requires gitpython")
+def test_source_create_uses_git_blob_digest(tmpdir, monkeypatch):
+    import git
+
+    repo = git.Repo.init(str(tmpdir))
+    f = tmpdir.join("example.py")
+    f.write("a = 1\n")
+    # the git CLI stores size and mtime of the file in the index
+    repo.git.add(str(f))
+    repo.index.commit("initial commit")
+    monkeypatch.setitem(SETTINGS, "GIT_SOURCE_DIGESTS", True)
+
+    from sacred import dependencies
+
+    with mock.patch.object(
+        dependencies, "_get_commit_from_repo", wraps=dependencies._get_commit_from_repo
+    ) as get_commit_from_repo:
+        s = Source.create(str(f))
+    assert s.digest == "git:" + repo.git.hash_object(str(f))
+    # without a VCSCache, the index entries are not collected
+    assert get_commit_from_repo.call_args[0][1] is None
+
+
+@pytest.mark.skipif(not opt.has_gitpython, reason="requires gitpython")
+def test_git_blob_digest_ignores_files_changed_since_lookup(tmpdir, monkeypatch):
+    import git
+    from sacred import dependencies
+
+    repo = git.Repo.init(str(tmpdir))
+    f = tmpdir.join("example.py")
+    f.write("a = 1\n")
+    repo.git.add(str(f))
+    repo.index.commit("initial commit")
+    monkeypatch.setitem(SETTINGS, "GIT_SOURCE_DIGESTS", True)
+
+    vcs_cache = VCSCache()
+    get_commit_if_possible(str(f), vcs_cache)
+    assert dependencies.get_git_blob_digest(str(f), vcs_cache) is not None
+    f.write("a = 22\n")
+    assert dependencies.get_git_blob_digest(str(f), vcs_cache) is None
+
+
+def test_source_ordering():
+    a = Source.create(EXAMPLE_SOURCE)
+    b = Source.create(os.path.join(TEST_DIRECTORY, "dependency_example.py"))
+    assert a < b
+    assert sorted([b, a]) == [a, b]
+
+
+@pytest.mark.skipif(not opt.has_gitpython, reason="requires gitpython")
+def test_get_commit_if_possible_inspects_each_repo_once(tmpdir):
+    import git
+    from sacred import dependencies
+
+    repo = git.Repo.init(str(tmpdir))
+    files = [tmpdir.join("a.py"), tmpdir.mkdir("pkg").join("b.py")]
+    for f in files:
+        f.write("")
+    repo.index.add([str(f) for f in files])
+    commit = repo.index.commit("initial commit")
+
+    vcs_cache = VCSCache()
+    with mock.patch.object(
+        dependencies,
+        "_get_commit_from_repo",
+        wraps=dependencies._get_commit_from_repo,
+    ) as get_commit_from_repo:
+        for f in files:
+            path, sha, is_dirty = get_commit_if_possible(str(f), vcs_cache)
+            assert sha == commit.hexsha
+            assert not is_dirty
+        assert get_commit_from_repo.call_count == 1
+
+
+def test_get_commit_if_possible_caches_only_with_vcs_cache():
+    from sacred import dependencies
+
+    with mock.patch.object(
+        dependencies, "_get_commit_from_directory", return_value=(None, None, None)
+    ) as get_commit_from_directory:
+        get_commit_if_possible(EXAMPLE_SOURCE)
+        get_commit_if_possible(EXAMPLE_SOURCE)
+        assert get_commit_from_directory.call_count == 2
+        vcs_cache = VCSCache()
+        get_commit_if_possible(EXAMPLE_SOURCE, vcs_cache)
+        get_commit_if_possible(EXAMPLE_SOURCE, vcs_cache)
+        assert get_commit_from_directory.call_count == 3
+        get_commit_if_possible(EXAMPLE_SOURCE)
+        assert get_commit_from_directory.call_count == 4
+
+
+@pytest.mark.skipif(not opt.has_gitpython, reason="requires gitpython")
+def test_source_create_after_gathering_checks_repo_again(tmpdir, monkeypatch):
+    import git
+
+    repo = git.Repo.init(str(tmpdir))
+    f = tmpdir.join("example.py")
+    f.write("a = 1\n")
+    repo.index.add([str(f)])
+    repo.index.commit("initial commit")
+    monkeypatch.setitem(SETTINGS, "GIT_SOURCE_DIGESTS", True)
+    gather_sources_and_dependencies({"__file__": str(f)})
+
+    f.write("a = 2\n")
+    s = Source.create(str(f))
+    assert s.is_dirty
+    assert s.digest == get_digest(str(f))
+
+
 def test_get_py_file_if_possible_with_py_file():
     assert get_py_file_if_possible(EXAMPLE_SOURCE) == EXAMPLE_SOURCE
 
@@ -138,6 +348,24 @@ def test_package_dependency_repr():
     assert repr(pd) == "<PackageDependency: pytest=12.4>"
 
 
+def test_get_dependencies_from_pkg_returns_copies():
+    deps = get_dependencies_from_pkg({}, TEST_DIRECTORY)
+    assert PackageDependency("pytest", None) in deps
+    deps.add(PackageDependency("doesnotexist", "1.0"))
+    assert get_dependencies_from_pkg({}, TEST_DIRECTORY) == deps - {
+        PackageDependency("doesnotexist", "1.0")
+    }
+
+
+def test_package_dependency_ordering():
+    a, b = PackageDependency("a", "1.0"), PackageDependency("b", None)
+    assert a < b
+    assert b > a
+    assert sorted([b, a]) == [a, b]
+    with pytest.raises(TypeError):
+        a <= b
+
+
 def test_gather_sources_and_dependencies():
     from tests.dependency_example import some_func
 
@@ -165,6 +393,68 @@ def test_gather_sources_and_dependencies():
         assert len(deps) == 2
 
 
+def test_iterate_all_python_files(tmpdir):
+    tmpdir.join("a.py").write("")
+    tmpdir.join("b.txt").write("")
+    tmpdir.mkdir("pkg").join("c.py").write("")
+    tmpdir.mkdir("__pycache__").join("d.py").write("")
+    tmpdir.mkdir(".venv").join("e.py").write("")
+    files = set(iterate_all_python_files(str(tmpdir)))
+    assert files == {str(tmpdir.join("a.py")), str(tmpdir.join("pkg", "c.py"))}
+
+
+def test_get_sources_from_local_dir(tmpdir):
+    from sacred import dependencies
+
+    files = [tmpdir.join("a.py"), tmpdir.join("b.py")]
+    files += [tmpdir.mkdir("pkg").join("c.py"), tmpdir.join("pkg", "d.py")]
+    for i, f in enumerate(files):
+        f.write("a = {}\n".format(i))
+
+    with mock.patch.object(
+        dependencies,
+        "_get_commit_from_directory",
+        wraps=dependencies._get_commit_from_directory,
+    ) as get_commit_from_directory:
+        sources = get_sources_from_local_dir({}, str(tmpdir))
+        assert get_commit_from_directory.call_count == 2
+
+    assert sources == {Source.create(str(f)) for f in files}
+    for s in sources:
+        assert s._digest == get_digest(s.filename)
+
+
+def test_get_sources_and_dependencies_from_modules():
+    from tests.dependency_example import some_func
+
+    globs = some_func.__globals__
+    sources, deps = get_sources_and_dependencies_from_modules(
+        iterate_imported_modules(globs), TEST_DIRECTORY
+    )
+    assert sources == get_sources_from_modules(
+        iterate_imported_modules(globs), TEST_DIRECTORY
+    )
+    assert deps == get_dependencies_from_modules(
+        iterate_imported_modules(globs), TEST_DIRECTORY
+    )
+
+
+@pytest.mark.parametrize("strategy", ["imported", "sys"])
+def test_gather_sources_and_dependencies_scans_modules_once(strategy, monkeypatch):
+    from sacred import dependencies
+    from tests.dependency_example import some_func
+
+    monkeypatch.setitem(SETTINGS, "DISCOVER_SOURCES", strategy)
+    monkeypatch.setitem(SETTINGS, "DISCOVER_DEPENDENCIES", strategy)
+    iterator = mock.Mock(wraps=dependencies.shared_module_iterators[strategy])
+    monkeypatch.setitem(dependencies.shared_module_iterators, strategy, iterator)
+
+    main, sources, deps = gather_sources_and_dependencies(some_func.__globals__)
+    assert iterator.call_count == 1
+    assert main in sources
+    assert PackageDependency.create(pytest) in deps
+
+
 def test_custom_base_dir():
     from tests.basedir.my_experiment import some_func
 
@@ -210,3 +500,31 @@ def test_custom_base_dir():
 )
 def test_is_local_source(f_name, mod_name, ex_path, is_local):
     assert is_local_source(f_name, mod_name, ex_path) == is_local
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Uses posix paths")
+@pytest.mark.parametrize(
+    "path, parts",
+    [
+        ("foo.py", ("foo.py",)),
+        ("./foo/bar.py", ("foo", "bar.py")),
+        ("foo//bar/", ("foo", "bar")),
+        ("/home/user/bar.py", ("/", "home", "user", "bar.py")),
+    ],
+)
+def test_splitall(path, parts):
+    assert splitall(path) == parts
+
+
+def test_is_local_source_ignores_case_where_paths_are_case_insensitive(monkeypatch):
+    from sacred import dependencies
+
+    # emulate os.path.normcase on Windows
+    monkeypatch.setattr(os.path, "normcase", lambda p: p.lower())
+    dependencies.get_base_path_prefix.cache_clear()
+    try:
+        assert is_local_source("/Home/User/bar.py", "bar", "/home/user/")
+        assert is_local_source("/home/user/Bar.py", "Bar", "/HOME/USER/")
+        assert not is_local_source("/home/user/Bar.py", "bar", "/HOME/USER/")
+    finally:
+        dependencies.get_base_path_prefix.cache_clear()
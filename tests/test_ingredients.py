@@ -234,6 +234,11 @@ def test_add_package_dependency_invalid_version_raises(ing):
         ing.add_package_dependency("django", "foobar")
 
 
+def test_add_package_dependency_version_with_valid_prefix_raises(ing):
+    with pytest.raises(ValueError):
+        ing.add_package_dependency("django", "1.0 beta")
+
+
 def test_get_experiment_info(ing):
     info = ing.get_experiment_info()
     assert info["name"] == "tickle"
@@ -438,3 +438,17 @@ def test_mongo_observer_artifact_event_metadata(mongo_obs, sample_run):
 
     db_run = mongo_obs.runs.find_one()
     assert db_run["artifacts"]
+
+
+@pytest.mark.parametrize("digest_prefix", ["b2:", "git:"])
+def test_mongo_observer_save_sources_looks_up_md5(mongo_obs, digest_prefix):
+    filename = "setup.py"
+    ex_info = {
+        "base_dir": os.path.join(os.path.dirname(__file__), "..", ".."),
+        "sources": [[filename, digest_prefix + "0" * 40]],
+    }
+    mongo_obs.save_sources(ex_info)
+    abs_path = os.path.join(ex_info["base_dir"], filename)
+    mongo_obs.fs.find_one.assert_called_once_with(
+        {"filename": abs_path, "md5": get_digest(abs_path)}
+    )
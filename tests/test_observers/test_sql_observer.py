@@ -146,6 +146,19 @@ def test_fs_observer_started_event_saves_source(sql_obs, sample_run, session, tm
     assert source.md5sum == tmpfile.md5sum
 
 
+@pytest.mark.parametrize("digest_prefix", ["b2:", "git:"])
+def test_sql_observer_started_event_saves_source_with_other_digest(
+    sql_obs, sample_run, session, tmpfile, digest_prefix
+):
+    digest = digest_prefix + "0" * 40
+    sample_run["ex_info"]["sources"] = [[tmpfile.name, digest]]
+
+    sql_obs.started_event(**sample_run)
+
+    assert session.query(Source).count() == 1
+    assert session.query(Source).first().md5sum == tmpfile.md5sum
+
+
 def test_sql_observer_heartbeat_event_updates_run(sql_obs, sample_run, session):
     sql_obs.started_event(**sample_run)
 
@@ -7,6 +7,7 @@ import datetime
 import tempfile
 import io
 
+import mock
 import pytest
 
 tinydb = pytest.importorskip("tinydb")
@@ -91,6 +92,16 @@ def test_tinydb_observer_started_event_uses_given_id(tinydb_obs, sample_run):
     assert db_run["_id"] == sample_run["_id"]
 
 
+def test_tinydb_observer_reuses_sources_with_other_digests(tinydb_obs, sample_run):
+    filename = "setup.py"
+    md5 = get_digest(filename)
+    sample_run["ex_info"]["sources"] = [[filename, "b2:" + "0" * 32]]
+    tinydb_obs.fs.get = mock.Mock(side_effect=tinydb_obs.fs.get)
+    tinydb_obs.started_event(**sample_run)
+    tinydb_obs.fs.get.assert_called_once_with(md5)
+    assert tinydb_obs.run_entry["experiment"]["sources"][0][1] == md5
+
+
 def test_tinydb_observer_started_event_saves_given_sources(tinydb_obs, sample_run):
     filename = "setup.py"
     md5 = get_digest(filename)